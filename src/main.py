@@ -1,21 +1,17 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import os
 import datetime
 import asyncio
-import pygame
 import logging
 import zmq
 from zmq.asyncio import Context
 
-from rcsnail import RCSnail
-
 from commons.common_zmq import initialize_publisher, initialize_subscriber
 from commons.configuration_manager import ConfigurationManager
 
-from src.pipeline.interceptor import Interceptor
-from src.utilities.JoystickCar import JoystickCar
-from src.utilities.KeyboardCar import KeyboardCar
-from src.utilities.JoystickRenderer import JoystickRenderer
-from src.utilities.KeyboardRenderer import KeyboardRenderer
+from src.pipeline.metrics import Metrics, StartupTimer
 
 
 def get_training_file_name(path_to_training):
@@ -25,52 +21,104 @@ def get_training_file_name(path_to_training):
     return date + "_test_" + str(int(len(files_from_same_date) / 2 + 1))
 
 
-def main(context: Context):
-    config_manager = ConfigurationManager()
-    config = config_manager.config
-    rcs = RCSnail()
-    rcs.sign_in_with_email_and_password(os.getenv('RCS_USERNAME', ''), os.getenv('RCS_PASSWORD', ''))
+def sign_in(rcs, startup: StartupTimer):
+    with startup.phase('sign_in'):
+        rcs.sign_in_with_email_and_password(os.getenv('RCS_USERNAME', ''), os.getenv('RCS_PASSWORD', ''))
 
-    loop = asyncio.get_event_loop()
 
-    data_queue = context.socket(zmq.PUB)
-    loop.run_until_complete(initialize_publisher(data_queue, config.data_queue_port))
+async def initialize_queues(context: Context, config, startup: StartupTimer):
+    with startup.phase('zmq_sockets'):
+        data_queue = context.socket(zmq.PUB)
+        controls_queue = context.socket(zmq.SUB)
+        await asyncio.gather(initialize_publisher(data_queue, config.data_queue_port),
+                             initialize_subscriber(controls_queue, config.controls_queue_port))
+    return data_queue, controls_queue
 
-    controls_queue = context.socket(zmq.SUB)
-    loop.run_until_complete(initialize_subscriber(controls_queue, config.controls_queue_port))
 
-    pygame_event_queue = asyncio.Queue()
-    pygame.init()
-    pygame.display.set_caption("RCSnail Connector")
+def main(context: Context, startup: StartupTimer):
+    with startup.phase('config'):
+        config_manager = ConfigurationManager()
+        config = config_manager.config
 
-    screen = pygame.display.set_mode((config.window_width, config.window_height))
-    interceptor = Interceptor(config, data_queue, controls_queue)
-    car = JoystickCar(config, send_car_state=interceptor.send_car_state, recv_car_controls=interceptor.recv_car_controls)
-    renderer = JoystickRenderer(config, screen, car)
-    renderer.init_controllers()
-    interceptor.set_renderer(renderer)
+    loop = asyncio.get_event_loop()
+    metrics = Metrics(config, startup=startup)
+
+    # imports stay on the main thread, as concurrent imports of the shared av/aiortc stack contend on import locks
+    with startup.phase('rcsnail_import'):
+        from rcsnail import RCSnail
+        rcs = RCSnail()
 
-    pygame_task = loop.run_in_executor(None, renderer.pygame_event_loop, loop, pygame_event_queue)
-    render_task = asyncio.ensure_future(renderer.render(rcs))
-    event_task = asyncio.ensure_future(renderer.register_pygame_events(pygame_event_queue))
-    queue_task = asyncio.ensure_future(rcs.enqueue(loop, interceptor.new_frame, interceptor.new_telemetry, track=config.track, car=config.car))
+    # sign-in is network bound, so it runs in an executor while the display, components and sockets are set up.
+    startup_tasks = [loop.run_in_executor(None, sign_in, rcs, startup)]
 
+    pygame = None
+    control_smoother = None
+    tasks = []
     try:
+        # pygame stays on the main thread, as SDL expects its window to be created there.
+        with startup.phase('pygame_init'):
+            import pygame
+            pygame.init()
+            pygame.display.set_caption("RCSnail Connector")
+            screen = pygame.display.set_mode((config.window_width, config.window_height))
+
+        with startup.phase('component_imports'):
+            from src.pipeline.interceptor import Interceptor
+            from src.pipeline.control_smoother import ControlSmoother
+            from src.utilities.JoystickCar import JoystickCar
+            from src.utilities.JoystickRenderer import JoystickRenderer
+
+        startup_tasks += [asyncio.ensure_future(initialize_queues(context, config, startup)),
+                          asyncio.ensure_future(metrics.start())]
+        loop.run_until_complete(asyncio.gather(*startup_tasks))
+        data_queue, controls_queue = startup_tasks[1].result()
+
+        with startup.phase('components'):
+            pygame_event_queue = asyncio.Queue()
+            interceptor = Interceptor(config, data_queue, controls_queue, metrics=metrics)
+            control_smoother = ControlSmoother(config, metrics=metrics)
+            car = JoystickCar(config, send_car_state=interceptor.send_car_state, recv_car_controls=interceptor.recv_car_controls,
+                              control_smoother=control_smoother, metrics=metrics)
+            renderer = JoystickRenderer(config, screen, car, metrics=metrics)
+            renderer.init_controllers()
+            interceptor.set_renderer(renderer)
+
+        tasks = [
+            asyncio.ensure_future(rcs.enqueue(loop, interceptor.new_frame, interceptor.new_telemetry, track=config.track, car=config.car)),
+            loop.run_in_executor(None, renderer.pygame_event_loop, loop, pygame_event_queue),
+            asyncio.ensure_future(renderer.render(rcs)),
+            asyncio.ensure_future(renderer.register_pygame_events(pygame_event_queue))
+        ]
+
         loop.run_forever()
     except KeyboardInterrupt:
         print("Closing due to keyboard interrupt.")
     finally:
-        queue_task.cancel()
-        pygame_task.cancel()
-        render_task.cancel()
-        event_task.cancel()
-        pygame.quit()
-        asyncio.ensure_future(rcs.close_client_session())
+        for task in tasks:
+            task.cancel()
+
+        # a failed startup leaves the other startup tasks running, they must finish cancelling before cleanup
+        pending_startup_tasks = [task for task in startup_tasks if not task.done()]
+        for task in pending_startup_tasks:
+            task.cancel()
+        if pending_startup_tasks:
+            loop.run_until_complete(asyncio.wait(pending_startup_tasks))
+
+        if pygame is not None:
+            pygame.quit()
+        if control_smoother is not None:
+            control_smoother.close()
+        loop.run_until_complete(asyncio.gather(metrics.close(), rcs.close_client_session()))
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
+    startup = StartupTimer(start=STARTUP_TIME)
+    startup.phase_since_start('module_imports')
+
     context = Context()
-    main(context)
-    context.destroy()
+    try:
+        main(context, startup)
+    finally:
+        context.destroy()
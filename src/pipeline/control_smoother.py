@@ -0,0 +1,122 @@
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from src.pipeline.metrics import Metrics
+
+
+class ControlSmoother:
+    def __init__(self, config, metrics: Metrics = None):
+        """Extrapolates model predictions when they arrive late. Rates are in control units per second, times in seconds."""
+        self.enabled = config.exists("smoothing_enabled") and config.smoothing_enabled == True
+        self.max_steering_rate = config.smoothing_max_steering_rate if config.exists("smoothing_max_steering_rate") else 2.0
+        self.max_throttle_rate = config.smoothing_max_throttle_rate if config.exists("smoothing_max_throttle_rate") else 1.0
+        self.staleness_limit = config.smoothing_staleness_limit if config.exists("smoothing_staleness_limit") else 0.5
+        self.rtt_alpha = config.smoothing_rtt_alpha if config.exists("smoothing_rtt_alpha") else 0.2
+        history_size = config.smoothing_history_size if config.exists("smoothing_history_size") else 3
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.predictions = deque(maxlen=history_size)
+        self.state_sent_time = None
+        self.round_trip = 0.0
+        self.last_output = None
+
+        self.stats = {'predicted': 0, 'extrapolated': 0, 'expert': 0}
+        self.stats_file = None
+        self.stats_flush_interval = 1.0
+        self.stats_flush_time = 0.0
+        if config.exists("smoothing_stats_path") and config.smoothing_stats_path:
+            self.stats_file = open(config.smoothing_stats_path, 'a')
+
+    def state_sent(self):
+        self.state_sent_time = time.time()
+
+    def resend_due(self):
+        """Returns whether the model hasn't been sent a state within the staleness limit."""
+        return self.state_sent_time is None or time.time() - self.state_sent_time > self.staleness_limit
+
+    def prediction_received(self, steering, throttle):
+        now = time.time()
+        if self.state_sent_time is not None:
+            rtt = now - self.state_sent_time
+            # replies to states sent before an outage would skew the average with the whole outage
+            if rtt <= self.staleness_limit:
+                self.round_trip = self.rtt_alpha * rtt + (1.0 - self.rtt_alpha) * self.round_trip
+                self.metrics.set_gauge('smoothing_round_trip_seconds', self.round_trip)
+            self.state_sent_time = None
+
+        self.predictions.append((now, steering, throttle))
+        if self.enabled:
+            self.last_output = (now, steering, throttle)
+            self.__record('predicted', now, 0.0, steering, throttle)
+
+    def smooth(self, car, steering_command, linear_command):
+        """Returns (steering, throttle, gear, expert) to use while no prediction is available, or None to hold current controls."""
+        if not self.enabled or len(self.predictions) == 0:
+            return None
+
+        now = time.time()
+        last_time, last_steering, last_throttle = self.predictions[-1]
+        age = now - last_time
+
+        if age > self.staleness_limit:
+            # the expert takes over immediately, lowering the throttle is the only way to slow down
+            steering, throttle = float(np.clip(steering_command, -1.0, 1.0)), float(np.clip(linear_command, 0.0, 1.0))
+            self.last_output = (now, steering, throttle)
+            self.__record('expert', now, age, steering, throttle)
+            return steering, throttle, car.d_gear, True
+
+        steering, throttle = last_steering, last_throttle
+        if len(self.predictions) > 1:
+            first_time, first_steering, first_throttle = self.predictions[0]
+            span = last_time - first_time
+            if span > 0.0:
+                steering_rate = np.clip((last_steering - first_steering) / span, -self.max_steering_rate, self.max_steering_rate)
+                throttle_rate = np.clip((last_throttle - first_throttle) / span, -self.max_throttle_rate, self.max_throttle_rate)
+
+                # predictions act on frames that are already a round trip old
+                horizon = age + self.round_trip
+                steering = float(np.clip(last_steering + steering_rate * horizon, -1.0, 1.0))
+                throttle = float(np.clip(last_throttle + throttle_rate * horizon, 0.0, 1.0))
+
+        steering, throttle = self.__limit_rate(now, steering, throttle)
+        self.__record('extrapolated', now, age, steering, throttle)
+        return steering, throttle, car.gear, False
+
+    def __limit_rate(self, now, steering, throttle):
+        """Bounds the change of an extrapolated output from the previous output."""
+        if self.last_output is not None:
+            last_time, last_steering, last_throttle = self.last_output
+            dt = now - last_time
+            steering = last_steering + np.clip(steering - last_steering, -self.max_steering_rate * dt, self.max_steering_rate * dt)
+            throttle = last_throttle + np.clip(throttle - last_throttle, -self.max_throttle_rate * dt, self.max_throttle_rate * dt)
+
+        steering, throttle = float(steering), float(throttle)
+        self.last_output = (now, steering, throttle)
+        return steering, throttle
+
+    def __record(self, decision, timestamp, age, steering, throttle):
+        self.stats[decision] += 1
+        self.metrics.increment('smoothing_' + decision)
+
+        if self.stats_file is not None:
+            self.stats_file.write(json.dumps({
+                'time': timestamp,
+                'decision': decision,
+                'age': age,
+                'round_trip': self.round_trip,
+                'steering': float(steering),
+                'throttle': float(throttle)
+            }) + "\n")
+
+            if timestamp - self.stats_flush_time > self.stats_flush_interval:
+                self.stats_file.flush()
+                self.stats_flush_time = timestamp
+
+    def close(self):
+        print("Control smoothing stats: {}".format(self.stats))
+        if self.stats_file is not None:
+            self.stats_file.close()
+            self.stats_file = None
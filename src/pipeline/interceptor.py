@@ -1,5 +1,4 @@
 import numpy as np
-from cv2 import flip
 from datetime import datetime
 from zmq.asyncio import Socket
 from PIL import Image
@@ -7,10 +6,13 @@ from PIL import Image
 from commons.car_controls import CarControlUpdates, CarControls
 from commons.common_zmq import send_array_with_json
 
+from src.pipeline.metrics import Metrics
+
 
 class Interceptor:
-    def __init__(self, config, data_queue: Socket, controls_queue: Socket):
+    def __init__(self, config, data_queue: Socket, controls_queue: Socket, metrics: Metrics = None):
         self.renderer = None
+        self.metrics = metrics if metrics is not None else Metrics()
         self.resolution = (config.frame_width, config.frame_height)
         self.resample = Image.NEAREST
         if config.exists("frame_scale_linear") and config.frame_scale_linear == True:
@@ -19,6 +21,9 @@ class Interceptor:
         self.controls_queue = controls_queue
 
         self.frame = None
+        # two buffers, so the frame being published isn't overwritten by the next conversion
+        self.frame_buffers = [np.empty((config.frame_height, config.frame_width, 3), dtype=np.float32) for _ in range(2)]
+        self.buffer_index = 0
         self.telemetry = None
         self.expert_updates = None
 
@@ -28,20 +33,28 @@ class Interceptor:
         self.renderer = renderer
 
     def new_frame(self, frame):
+        self.metrics.interval('frame_interval')
+        self.metrics.increment('frames_received')
         self.renderer.handle_new_frame(frame)
 
         if frame is not None:
-            self.frame = self.__convert_frame(frame)
+            if self.frame is None:
+                self.metrics.first_frame()
+
+            with self.metrics.timer('conversion'):
+                self.frame = self.__convert_frame(frame)
 
     def __convert_frame(self, frame):
         # for some forsaken reason it needs to be flipped here.
         try:
             image = frame.to_image()
             resized_image = image.resize(self.resolution, self.resample)
-            np_array = np.array(resized_image, dtype=np.float32)
-            np_array = flip(np_array, 1)
-            return np_array
+            buffer = self.frame_buffers[self.buffer_index]
+            self.buffer_index = 1 - self.buffer_index
+            np.copyto(buffer, np.asarray(resized_image)[:, ::-1])
+            return buffer
         except Exception as ex:
+            self.metrics.increment('conversion_exceptions')
             print("Convert frame exception: {}".format(ex))
 
     def new_telemetry(self, telemetry):
@@ -54,27 +67,35 @@ class Interceptor:
             if self.frame is None or self.telemetry is None:
                 return True
 
-            self.expert_updates = CarControlUpdates(car.d_gear, car.d_steering, car.d_throttle, car.d_braking, car.manual_override)
-            self.telemetry['conn_time'] = int(datetime.now().timestamp() * 1000)
-            if self.expert_supervision_enabled:
-                send_array_with_json(self.data_queue, self.frame, (self.telemetry, self.expert_updates.to_dict()))
-            else:
-                send_array_with_json(self.data_queue, self.frame, self.telemetry)
+            with self.metrics.timer('publish'):
+                self.expert_updates = CarControlUpdates(car.d_gear, car.d_steering, car.d_throttle, car.d_braking,
+                                                     car.manual_override or car.expert_fallback)
+                self.telemetry['conn_time'] = int(datetime.now().timestamp() * 1000)
+                if self.expert_supervision_enabled:
+                    send_array_with_json(self.data_queue, self.frame, (self.telemetry, self.expert_updates.to_dict()))
+                else:
+                    send_array_with_json(self.data_queue, self.frame, self.telemetry)
 
             return False
         except Exception as ex:
+            self.metrics.increment('publish_exceptions')
             print("Car state send exception: {}".format(ex))
 
     async def recv_car_controls(self):
         try:
-            prediction_ready = await self.controls_queue.poll(timeout=5)
+            with self.metrics.timer('control_poll'):
+                prediction_ready = await self.controls_queue.poll(timeout=5)
 
             if prediction_ready:
-                predicted_updates = await self.controls_queue.recv_json()
+                with self.metrics.timer('control_receive'):
+                    predicted_updates = await self.controls_queue.recv_json()
 
                 if predicted_updates is not None:
+                    self.metrics.increment('predictions_received')
                     return predicted_updates
             else:
+                self.metrics.increment('prediction_polls_empty')
                 return None
         except Exception as ex:
+            self.metrics.increment('control_receive_exceptions')
             print("Car control receive exception: {}".format(ex))
@@ -0,0 +1,285 @@
+import asyncio
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class StageTimer:
+    def __init__(self, stats):
+        self.stats = stats
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.stats[0] += 1
+        self.stats[1] += elapsed
+        self.stats[2] = max(self.stats[2], elapsed)
+        return False
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class StartupPhase:
+    def __init__(self, startup, name):
+        self.startup = startup
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.startup.phases.append((self.name, self.start - self.startup.start, time.perf_counter() - self.start))
+        return False
+
+
+class StartupTimer:
+    def __init__(self, start=None):
+        """Records startup phases as (name, offset from start, duration). Phases may run concurrently in other threads."""
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = []
+        self.first_frame_time = None
+
+    def phase(self, name):
+        return StartupPhase(self, name)
+
+    def phase_since_start(self, name):
+        """Records a phase that ran from the timer start until now, e.g. module imports before the timer existed."""
+        self.phases.append((name, 0.0, time.perf_counter() - self.start))
+
+    def first_frame(self):
+        if self.first_frame_time is None:
+            self.first_frame_time = time.perf_counter() - self.start
+            self.report()
+
+    def report(self):
+        for name, offset, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            print("Startup phase {}: started at {:.3f} s, took {:.3f} s".format(name, offset, duration))
+        if self.first_frame_time is not None:
+            print("Startup first frame after {:.3f} s".format(self.first_frame_time))
+
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, thread_id, duration, interval, path):
+        """Samples the stack of one thread and writes it in collapsed format for flamegraph.pl/speedscope."""
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.duration = duration
+        self.interval = interval
+        self.path = path
+
+    def run(self):
+        stacks = Counter()
+        end_time = time.time() + self.duration
+
+        while time.time() < end_time:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+        try:
+            with open(self.path, 'w') as file:
+                for stack, count in stacks.items():
+                    file.write("{} {}\n".format(stack, count))
+            print("Profile written to {}".format(self.path))
+        except Exception as ex:
+            print("Profile write exception: {}".format(ex))
+
+
+class Metrics:
+    def __init__(self, config=None, startup: StartupTimer = None):
+        """Per-stage timers and event counters. Disabled metrics are no-ops, so callers don't need to check."""
+        self.enabled = config is not None and config.exists("metrics_enabled") and config.metrics_enabled == True
+        self.startup = startup if startup is not None else StartupTimer()
+        self.timers = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.__null_timer = NullTimer()
+
+        self.interval_times = {}
+
+        exists = config.exists if config is not None else lambda key: False
+        self.host = config.metrics_host if exists("metrics_host") else "127.0.0.1"
+        self.port = config.metrics_port if exists("metrics_port") else 0
+        self.file_path = config.metrics_file_path if exists("metrics_file_path") else ""
+        self.file_interval = config.metrics_file_interval if exists("metrics_file_interval") else 10.0
+        self.profile_dir = config.profile_output_dir if exists("profile_output_dir") else "."
+        self.profile_interval = config.profile_interval if exists("profile_interval") else 0.005
+        self.profile_max_seconds = config.profile_max_seconds if exists("profile_max_seconds") else 300.0
+        self.profile_signal_seconds = config.profile_signal_seconds if exists("profile_signal_seconds") else 10.0
+
+        self.profiler = None
+        self.loop_thread_id = None
+        self.__runner = None
+        self.__file_task = None
+
+    def timer(self, stage):
+        if not self.enabled:
+            return self.__null_timer
+
+        if stage not in self.timers:
+            # count, total seconds, max seconds
+            self.timers[stage] = [0, 0.0, 0.0]
+        return StageTimer(self.timers[stage])
+
+    def interval(self, stage):
+        """Records the time since the previous call for the same stage, e.g. the time between frames."""
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        last_time = self.interval_times.get(stage)
+        self.interval_times[stage] = now
+        if last_time is None:
+            return
+
+        if stage not in self.timers:
+            self.timers[stage] = [0, 0.0, 0.0]
+        stats = self.timers[stage]
+        stats[0] += 1
+        stats[1] += now - last_time
+        stats[2] = max(stats[2], now - last_time)
+
+    def first_frame(self):
+        self.startup.first_frame()
+
+    def increment(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def render(self):
+        """Returns all metrics in Prometheus text exposition format. Stage maximums cover the time since the previous render."""
+        lines = []
+        for stage, stats in sorted(self.timers.items()):
+            count, total, maximum = stats
+            lines.append('rcsnail_stage_seconds_count{{stage="{}"}} {}'.format(stage, count))
+            lines.append('rcsnail_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(stage, total))
+            lines.append('rcsnail_stage_seconds_max{{stage="{}"}} {:.6f}'.format(stage, maximum))
+            stats[2] = 0.0
+        for name, count in sorted(self.counters.items()):
+            lines.append('rcsnail_events_total{{name="{}"}} {}'.format(name, count))
+        for name, value in sorted(self.gauges.items()):
+            lines.append('rcsnail_{} {:.6f}'.format(name, value))
+        for name, _, duration in self.startup.phases:
+            lines.append('rcsnail_startup_seconds{{phase="{}"}} {:.6f}'.format(name, duration))
+        if self.startup.first_frame_time is not None:
+            lines.append('rcsnail_startup_seconds{{phase="first_frame"}} {:.6f}'.format(self.startup.first_frame_time))
+        return "\n".join(lines) + "\n"
+
+    def start_profiler(self, seconds):
+        """Returns the profile output path, or None if a profile is already being recorded."""
+        if not math.isfinite(seconds) or seconds <= 0.0 or seconds > self.profile_max_seconds:
+            raise ValueError("Profile duration must be in range (0, {}] s".format(self.profile_max_seconds))
+        if self.profiler is not None and self.profiler.is_alive():
+            return None
+
+        file_name = "profile_{}.folded".format(time.strftime("%Y_%m_%d_%H_%M_%S"))
+        path = os.path.join(self.profile_dir, file_name)
+        self.profiler = SamplingProfiler(self.loop_thread_id, seconds, self.profile_interval, path)
+        self.profiler.start()
+        return path
+
+    async def start(self):
+        if not self.enabled:
+            return
+
+        self.loop_thread_id = threading.get_ident()
+        self.__add_profile_signal_handler()
+
+        if self.port:
+            await self.__start_server()
+        if self.file_path:
+            self.__file_task = asyncio.ensure_future(self.__write_file_periodically())
+
+    async def __start_server(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self.__handle_metrics)
+        app.router.add_post('/profile', self.__handle_profile)
+
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        try:
+            await web.TCPSite(self.__runner, self.host, self.port).start()
+            print("Metrics available at http://{}:{}/metrics".format(self.host, self.port))
+        except OSError as ex:
+            print("Metrics server exception, continuing without endpoint: {}".format(ex))
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    def __add_profile_signal_handler(self):
+        """SIGUSR1 starts a profile, so profiling works without the endpoint. Not available on Windows."""
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+
+        try:
+            asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, self.__handle_profile_signal)
+        except (NotImplementedError, RuntimeError) as ex:
+            print("Profile signal handler exception: {}".format(ex))
+
+    def __handle_profile_signal(self):
+        path = self.start_profiler(self.profile_signal_seconds)
+        if path is None:
+            print("Profiler already running")
+        else:
+            print("Profiling for {} s into {}".format(self.profile_signal_seconds, path))
+
+    async def __handle_metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=self.render())
+
+    async def __handle_profile(self, request):
+        from aiohttp import web
+
+        try:
+            seconds = float(request.query.get('seconds', 10))
+            path = self.start_profiler(seconds)
+        except ValueError as ex:
+            return web.Response(status=400, text="Invalid seconds: {}\n".format(ex))
+
+        if path is None:
+            return web.Response(status=409, text="Profiler already running\n")
+        return web.Response(text="Profiling for {} s into {}\n".format(seconds, path))
+
+    async def __write_file_periodically(self):
+        while True:
+            await asyncio.sleep(self.file_interval)
+            try:
+                with open(self.file_path, 'w') as file:
+                    file.write(self.render())
+            except Exception as ex:
+                print("Metrics file write exception: {}".format(ex))
+
+    async def close(self):
+        if self.enabled and hasattr(signal, 'SIGUSR1'):
+            asyncio.get_event_loop().remove_signal_handler(signal.SIGUSR1)
+        if self.__file_task is not None:
+            self.__file_task.cancel()
+        if self.__runner is not None:
+            await self.__runner.cleanup()
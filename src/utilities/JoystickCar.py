@@ -1,8 +1,10 @@
 import numpy as np
 
+from src.pipeline.metrics import Metrics
+
 
 class JoystickCar:
-    def __init__(self, configuration, send_car_state=None, recv_car_controls=None):
+    def __init__(self, configuration, send_car_state=None, recv_car_controls=None, control_smoother=None, metrics: Metrics = None):
         """Controls are in range 0..1. Gear has discrete values from {1, 0, -1}."""
         self.steering = 0.0
         self.throttle = 0.0
@@ -14,6 +16,7 @@ class JoystickCar:
         self.d_gear = 0
 
         self.manual_override = False
+        self.expert_fallback = False
         self.p_steering = 0.0
 
         self.linear_command = 0.0
@@ -29,29 +32,40 @@ class JoystickCar:
 
         self.__send_car_state = send_car_state
         self.__recv_car_controls = recv_car_controls
+        self.__control_smoother = control_smoother
+        self.__metrics = metrics if metrics is not None else Metrics()
 
     def update_car_state(self, steering_command, linear_command):
         """Returns whether or not it should try sending state again."""
         try:
-            self.__update_gear(self.__override_enabled)
-            self.__update_steering(steering_command, self.__override_enabled)
-            self.__update_linear_movement(linear_command, self.__override_enabled)
+            with self.__metrics.timer('car_update'):
+                self.__update_gear(self.__override_enabled)
+                self.__update_steering(steering_command, self.__override_enabled)
+                self.__update_linear_movement(linear_command, self.__override_enabled)
 
             if self.__override_enabled:
-                return self.__send_car_state(self)
+                should_resend = self.__send_car_state(self)
+                if should_resend is False and self.__control_smoother is not None:
+                    self.__control_smoother.state_sent()
+                return should_resend
         except Exception as ex:
+            self.__metrics.increment('car_update_exceptions')
             print("Car update exception: {}".format(ex))
 
-    async def update_car_controls(self, steering_command, linear_command):
-        """Returns whether or not we can send a new state."""
+    async def update_car_controls(self, steering_command, linear_command, live_steering, live_linear):
+        """Returns whether or not we can send a new state. Live commands are the current joystick input."""
         update_dict = await self.__recv_car_controls()
 
         if update_dict is None:
-            return False
+            return self.__smooth_car_controls(live_steering, live_linear)
         else:
             self.steering = np.clip(update_dict['d_steering'], -1.0, 1.0)
             self.gear = update_dict['d_gear']
             self.throttle = np.clip(update_dict['d_throttle'], 0.0, 1.0)
+            self.expert_fallback = False
+
+            if self.__control_smoother is not None:
+                self.__control_smoother.prediction_received(self.steering, self.throttle)
 
             self.linear_command = linear_command
             self.steering_command = steering_command
@@ -62,6 +76,27 @@ class JoystickCar:
 
             return True
 
+    def __smooth_car_controls(self, live_steering, live_linear):
+        if self.__control_smoother is None:
+            return False
+
+        smoothed = self.__control_smoother.smooth(self, live_steering, live_linear)
+        if smoothed is None:
+            return False
+
+        self.steering, self.throttle, self.gear, self.expert_fallback = smoothed
+        if not self.expert_fallback:
+            return False
+
+        # the expert drives with the live joystick, so expert updates and later command diffs start from it
+        self.d_steering = float(np.clip(live_steering, -1.0, 1.0))
+        self.d_throttle = float(np.clip(live_linear, 0.0, 1.0))
+        self.steering_command = live_steering
+        self.linear_command = live_linear
+
+        # keep offering the model fresh states, so the lockstep loop resumes once it answers again
+        return self.__control_smoother.resend_due()
+
     def __update_gear(self, control_override: bool):
         if not control_override:
             self.gear = self.d_gear
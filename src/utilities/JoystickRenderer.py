@@ -3,11 +3,12 @@ import time
 import pygame
 from av import VideoFrame
 
+from src.pipeline.metrics import Metrics
 from src.utilities import JoystickCar
 
 
 class JoystickRenderer:
-    def __init__(self, config, screen, car: JoystickCar):
+    def __init__(self, config, screen, car: JoystickCar, metrics: Metrics = None):
         self.window_width = 1000   # wtf figure this diff out later config.window_width
         self.window_height = config.window_height
         self.bottom_height_diff = 15
@@ -15,8 +16,11 @@ class JoystickRenderer:
 
         self.FPS = config.FPS
         self.latest_frame = None
+        self.frame_surface = None
+        self.scaled_surface = None
         self.screen = screen
         self.car = car
+        self.metrics = metrics if metrics is not None else Metrics()
 
         self.model_override_enabled = config.model_override_enabled
 
@@ -37,6 +41,16 @@ class JoystickRenderer:
         self.gear_down_button = 2
         self.manual_control_toggle_button = 1
 
+        if config.exists("stream_width") and config.exists("stream_height"):
+            self.prepare_buffers(config.stream_width, config.stream_height)
+
+    def prepare_buffers(self, frame_width, frame_height):
+        """Allocates the surfaces frames are copied and scaled into, so rendering doesn't allocate per frame."""
+        height = self.window_height - self.bottom_height_diff
+        width = height * frame_width // frame_height
+        self.frame_surface = pygame.Surface((frame_width, frame_height))
+        self.scaled_surface = pygame.Surface((width, height))
+
     def init_controllers(self):
         if self.controller is not None:
             self.controller.init()
@@ -97,6 +111,8 @@ class JoystickRenderer:
         self.render_text(gear_text, x=5, y=50, color=self.green)
 
         manual_override_text = 'manual override' if self.car.manual_override else ''
+        if not self.car.manual_override and self.car.expert_fallback:
+            manual_override_text = 'expert fallback'
         self.render_text(manual_override_text, x=5, y=25, color=self.red)
 
     def render_text(self, text, x, y, color):
@@ -128,25 +144,30 @@ class JoystickRenderer:
                         sent_steering, sent_throttle = steering, throttle
 
                         should_resend = self.car.update_car_state(sent_steering, sent_throttle)
-                    should_send = await self.car.update_car_controls(sent_steering, sent_throttle)
+                    should_send = await self.car.update_car_controls(sent_steering, sent_throttle, steering, throttle)
                 else:
                     self.car.update_car_state(steering, throttle)
-                await rcs.updateControl(self.car.gear, self.car.steering, self.car.throttle, self.car.braking)
-
-                self.screen.fill(self.black)
-                if isinstance(self.latest_frame, VideoFrame):
-                    image_to_ndarray = self.latest_frame.to_rgb().to_ndarray()
-                    surface = pygame.surfarray.make_surface(image_to_ndarray.swapaxes(0, 1))
-                    height = self.window_height - self.bottom_height_diff
-                    width = height * self.latest_frame.width // self.latest_frame.height
-                    x = (self.window_width - self.right_width_diff - width) // 2
-                    y = 0
-                    scaled_frame = pygame.transform.scale(surface, (width, height))
-                    self.screen.blit(scaled_frame, (x, y))
-
-                self.draw(steering, throttle)
-                pygame.display.flip()
+                with self.metrics.timer('update_control'):
+                    await rcs.updateControl(self.car.gear, self.car.steering, self.car.throttle, self.car.braking)
+
+                with self.metrics.timer('render'):
+                    self.screen.fill(self.black)
+                    if isinstance(self.latest_frame, VideoFrame):
+                        frame_size = (self.latest_frame.width, self.latest_frame.height)
+                        if self.frame_surface is None or self.frame_surface.get_size() != frame_size:
+                            self.prepare_buffers(*frame_size)
+
+                        image_to_ndarray = self.latest_frame.to_rgb().to_ndarray()
+                        pygame.surfarray.blit_array(self.frame_surface, image_to_ndarray.swapaxes(0, 1))
+                        pygame.transform.scale(self.frame_surface, self.scaled_surface.get_size(), self.scaled_surface)
+                        x = (self.window_width - self.right_width_diff - self.scaled_surface.get_width()) // 2
+                        y = 0
+                        self.screen.blit(self.scaled_surface, (x, y))
+
+                    self.draw(steering, throttle)
+                    pygame.display.flip()
         except Exception as ex:
+            self.metrics.increment('render_exceptions')
             print("Rendering exception: {}".format(ex))
 
     def handle_new_frame(self, frame):